@@ -0,0 +1,105 @@
+import Globals
+import json
+import os
+
+class BuildManifest(object):
+    '''
+    The BuildManifest remembers every file a build produced (as reported by
+    PageWriter.get_produced()), so the next build can tell which of those it
+    didn't produce again.  Those are orphans, like archive pages for comics
+    that got removed or re-dated, and they get deleted all in one go, rather
+    than us having to go crawling through the whole site looking for them.
+
+    The manifest itself is just a sorted JSON list of full paths, stored in
+    datadir as manifestfile.
+    '''
+    def __init__(self):
+        self._filename = Globals.get_directory_for('datadir') + Globals.config.get('AutoNifty', 'manifestfile')
+
+    def load(self):
+        '''
+        Reads in the previous build's manifest and returns it as a set.  If
+        there isn't one (or it's garbage), that's an empty set, meaning nothing
+        will be considered orphaned this time around.
+
+        JSON gives us back unicode, but everything else (PageWriter's list,
+        sitedir) is plain UTF-8 strings, so the paths get encoded back to
+        those.  Otherwise a non-ASCII path would never match anything.
+        '''
+        try:
+            f = open(self._filename, 'r')
+        except IOError:
+            return set()
+
+        try:
+            return set(path.encode('utf-8') for path in json.load(f))
+        except ValueError:
+            print "BuildManifest: {} isn't a valid manifest, ignoring it...".format(self._filename)
+            return set()
+        finally:
+            f.close()
+
+    def save(self, produced):
+        '''
+        Writes out the given list of files as the new manifest.  Paths that
+        aren't valid UTF-8 can't go in a JSON file, so those get left out
+        (meaning they won't be cleaned up if they're orphaned later).
+        '''
+        tosave = []
+        for path in sorted(set(produced)):
+            try:
+                tosave.append(path.decode('utf-8'))
+            except UnicodeDecodeError:
+                print "BuildManifest: {} isn't a UTF-8 path, leaving it out of the manifest...".format(repr(path))
+
+        tempname = self._filename + '.tmp'
+        f = open(tempname, 'w')
+        try:
+            json.dump(tosave, f, indent=0)
+        finally:
+            f.close()
+        os.rename(tempname, self._filename)
+
+    def update(self, produced, dry_run=None):
+        '''
+        Compares the files produced by this build against the last manifest,
+        deletes anything that was produced last time but not this time, and
+        saves the new manifest.  Returns the sorted list of orphaned files that
+        were (or would be) removed.
+
+        With dry_run, nothing gets deleted and the old manifest is left as it
+        was; you just get the list of what WOULD have been removed.  If dry_run
+        isn't given, it comes from the manifestdryrun config option.
+
+        As a safety measure, only files inside sitedir will ever be deleted.
+        Anything else in the orphan list gets complained about and left alone,
+        dry run or not.
+        '''
+        sitedir = Globals.get_directory_for('sitedir')
+
+        if dry_run is None:
+            dry_run = Globals.config.getboolean('AutoNifty', 'manifestdryrun')
+
+        previous = self.load()
+        orphans = []
+        for orphan in sorted(previous - set(produced)):
+            if orphan.startswith(sitedir):
+                orphans.append(orphan)
+            else:
+                print "BuildManifest: {} is outside of sitedir, not removing it...".format(orphan)
+
+        if dry_run:
+            for orphan in orphans:
+                print "BuildManifest: Would remove {}".format(orphan)
+            return orphans
+
+        for orphan in orphans:
+            try:
+                os.remove(orphan)
+            except OSError as e:
+                # If it's already gone, great, that's what we wanted anyway.
+                if os.path.exists(orphan):
+                    print "ERROR: Couldn't remove orphaned file {}: {}".format(orphan, e.strerror)
+
+        self.save(produced)
+        return orphans
@@ -1,11 +1,104 @@
 import Globals
+from HashIndex import HashIndex
 import glob
 import re
-import datetime
 import os
+import shutil
+import StringIO
 
 DATESTAMP_RE = re.compile("(?P<full>(?P<year>\\d{4})(?P<month>\\d{2})(?P<day>\\d{2}))")
 
+# How much of a text comic gets read in at a time when copying it into a page.
+COMIC_CHUNK_SIZE = 64 * 1024
+
+# Every MMDD that can possibly be a real date, as ints.  February 29th is in
+# here, too, so that one still needs a leap year check.
+VALID_MONTHDAYS = frozenset(month * 100 + day
+        for month, days in enumerate([31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], 1)
+        for day in range(1, days + 1))
+
+def _is_valid_datestamp(datestamp):
+    '''
+    Checks if a YYYYMMDD int is a real date, without having to go through the
+    trouble of making a datetime out of it.
+    '''
+    year = datestamp // 10000
+    monthday = datestamp % 10000
+
+    if year < 1 or monthday not in VALID_MONTHDAYS:
+        return False
+
+    if monthday == 229:
+        return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+    return True
+
+def classify_comic_files(filenames, today=None):
+    '''
+    Sorts out a whole directory listing's worth of comic filenames in one go.
+    This returns a tuple of four lists:
+
+    - valid: (datestamp, filename) tuples for every file with a legit
+      datestamp in its name, the datestamp being the YYYYMMDD string
+    - due: the subset of valid that's dated today or earlier (only filled in
+      if you pass in a today tuple, as per Globals.get_today())
+    - nodate: filenames with no datestamp at all
+    - baddate: filenames whose datestamp isn't a real date
+
+    It's up to the caller to complain about the last two.
+    '''
+    valid = []
+    due = []
+    nodate = []
+    baddate = []
+
+    if today is not None:
+        todaystamp = today[0] * 10000 + today[1] * 100 + today[2]
+
+    for fname in filenames:
+        match = DATESTAMP_RE.search(fname)
+        if match is None:
+            nodate.append(fname)
+            continue
+
+        full = match.group('full')
+        datestamp = int(full)
+        if not _is_valid_datestamp(datestamp):
+            baddate.append(fname)
+            continue
+
+        valid.append((full, fname))
+        if today is not None and datestamp <= todaystamp:
+            due.append((full, fname))
+
+    return (valid, due, nodate, baddate)
+
+def _list_files(directory):
+    '''
+    Gets the names (not full paths) of all the plain files in a directory.
+    Subdirectories and the like are quietly skipped.
+    '''
+    return [f[len(directory):] for f in glob.glob(directory + '*') if os.path.isfile(f)]
+
+def _report_ignored(caller, nodate, baddate):
+    '''
+    Complains about whatever classify_comic_files() couldn't make sense of.
+    '''
+    for fname in nodate:
+        print "{}: Comic file {} has no datestamp in its name, ignoring...".format(caller, fname)
+    for fname in baddate:
+        print "{}: Comic file {} contains an invalid date, ignoring...".format(caller, fname)
+
+    if len(nodate) > 0 or len(baddate) > 0:
+        print "{}: Ignored {} file(s) with no datestamp and {} file(s) with invalid dates.".format(caller, len(nodate), len(baddate))
+
+def _is_text_comic(comic_file):
+    '''
+    Text (or HTML) comics get dumped into the page as-is; everything else is
+    an image.  This tells you which is which.
+    '''
+    return comic_file.endswith('.html') or comic_file.endswith('.htm') or comic_file.endswith('.text') or comic_file.endswith('.txt')
+
 class ComicBucket(object):
     '''
     The ComicBucket processes and contains all the comics in the system.  That
@@ -20,6 +113,8 @@ class ComicBucket(object):
     def __init__(self):
         self._active_comics = {}
         self._sorted_keys = []
+        self._hash_index = None
+        self._prefetcher = None
 
     def __len__(self):
         '''
@@ -45,6 +140,22 @@ class ComicBucket(object):
         '''
         return self._active_comics[date]
 
+    def get_text_files_for(self, date):
+        '''
+        Gets the full paths of all the text comics for the given datestamp.
+        That is, the ones that'll actually need to be read in when the page is
+        made (images just get an img tag).  Hand these to a Prefetcher.
+        '''
+        comicsdir = Globals.get_directory_for('comicsdir')
+        return [comicsdir + comic for comic in self.get_comics_for(date) if _is_text_comic(comic)]
+
+    def set_prefetcher(self, prefetcher):
+        '''
+        Sets a Prefetcher to check for text comics before opening them.  Pass
+        None to go back to opening everything directly.
+        '''
+        self._prefetcher = prefetcher
+
     def get_first(self):
         '''
         Gets the first date of comics.  This will be a tuple of the datestamp
@@ -112,41 +223,17 @@ class ComicBucket(object):
         comicsdir = Globals.get_directory_for('comicsdir')
         today = Globals.get_today()
 
-        # All files report in!
-        filelist = glob.glob(uploaddir + '*')
-        filesmoved = 0
+        # All files report in!  And just what ARE those files?  Funny you
+        # should ask...
+        valid, due, nodate, baddate = classify_comic_files(_list_files(uploaddir), today)
+        _report_ignored("filter_bucket", nodate, baddate)
 
-        # And just what ARE those files?  Funny you should ask...
-        for f in filelist:
-            if not os.path.isfile(f):
-                continue
-
-            # Strip it down to just the name, but keep the full path.  We may
-            # need it in a sec.
-            fname = f[len(uploaddir):]
-
-            match = re.search(DATESTAMP_RE, fname)
-            if match is None:
-                # Bad file name?  No datestamp?
-                print "filter_bucket: Comic file {} has no datestamp in its name, ignoring...".format(fname)
-                continue
-            else:
-                # Bad date?
-                year = int(match.group('year'))
-                month = int(match.group('month'))
-                day = int(match.group('day'))
-
-                try:
-                    datetime.datetime(year=year, month=month, day=day)
-                except ValueError:
-                    print "filter_bucket: Comic file {} contains an invalid date, ignoring...".format(fname)
-                    continue
-
-                # So it's a valid filename.  Is it, however, TODAY (or earlier)???
-                if year < today[0] or (year == today[0] and month < today[1]) or (year == today[0] and month == today[1] and day <= today[2]):
-                    # It's today!  It's today!  Hooray!  Hooray!  Move the file!
-                    os.rename(f, comicsdir + fname)
-                    filesmoved += 1
+        # Anything that's TODAY (or earlier) gets moved.  It's today!  It's
+        # today!  Hooray!  Hooray!
+        filesmoved = 0
+        for full, fname in due:
+            os.rename(uploaddir + fname, comicsdir + fname)
+            filesmoved += 1
 
         # Done!  Return how many we got.  I don't know why, maybe we want to
         # report that later.
@@ -163,43 +250,22 @@ class ComicBucket(object):
         # CLEAR!
         self._active_comics = {}
 
-        # Pop open the file list.  All of them.
-        filelist = glob.glob(comicsdir + '*')
+        # Pop open the file list.  All of them.  Ignore directories, just
+        # plain files.
+        valid, due, nodate, baddate = classify_comic_files(_list_files(comicsdir))
+        _report_ignored("read_bucket", nodate, baddate)
 
         # Now, we don't have any clue what order these are in, so we have to
         # build up the entire dictionary on the fly.  Fortunately, we also
         # don't have any clue what order the dictionary is in once we've stored
         # it, so it fits in.
-        for f in filelist:
-            # Ignore directories.  Just plain files.
-            if not os.path.isfile(f):
-                # No warning, though.  This is okay.
-                continue
-
-            f = f[len(comicsdir):]
-
-            # Does the filename contain a datestamp?  That's eight digits.
-            match = re.search(DATESTAMP_RE, f)
-
-            if match is None:
-                print "read_bucket: Comic file {} has no datestamp in its name, ignoring...".format(f)
-                continue
-            else:
-                # Okay, we've got a date.  Is it legal?
-                try:
-                    datetime.datetime(year=int(match.group('year')), month=int(match.group('month')), day=int(match.group('day')))
-                except ValueError:
-                    # Whoops.  That's not valid at all.
-                    print "read_bucket: Comic file {} contains an invalid date, ignoring...".format(f)
-                    continue
-
-                # It's valid!  Add the date and the file in!  First, initialize
-                # a list if we don't have that date yet.
-                full = match.group('full')
-                if full not in self._active_comics:
-                    self._active_comics[full] = []
-
-                self._active_comics[full].append(f)
+        for full, f in valid:
+            # Add the date and the file in!  First, initialize a list if we
+            # don't have that date yet.
+            if full not in self._active_comics:
+                self._active_comics[full] = []
+
+            self._active_comics[full].append(f)
 
         # Now, though we don't know what order we get the files in, we DO need
         # to make sure each individual date's list is in alphabetical order, as
@@ -211,45 +277,118 @@ class ComicBucket(object):
         # time we need a comic.
         self._sorted_keys = sorted(self._active_comics.keys())
 
+        # If we're fingerprinting image URLs, now's when we figure out which
+        # images need (re-)hashing.
+        if Globals.config.getboolean('AutoNifty', 'cachebustimages'):
+            self._update_hash_index(comicsdir)
+
+    def _update_hash_index(self, comicsdir):
+        '''
+        Loads the image hash index, hashes anything in the bucket that's new or
+        changed since last time, and saves it back out.
+        '''
+        if self._hash_index is None:
+            self._hash_index = HashIndex()
+            self._hash_index.load()
+
+        images = []
+        for l in self._active_comics.values():
+            for comic in l:
+                if not _is_text_comic(comic):
+                    images.append(comic)
+
+        self._hash_index.update(comicsdir, images)
+        self._hash_index.save()
+
     def get_html_for_comic(self, comic_file):
         '''
         Gets the HTML that should be output for a given comic file.  As of the
         current design, any .txt or .html file (or .text or .htm, just for
         completeness) will be dumped out as-is (with a carriage return at the
         end), and any other file will be the src of an img tag.
+
+        This builds the whole thing up as a string, text comic and all, so it
+        does NOT keep memory bounded.  Tags have to hand back strings, so that's
+        what the page rendering uses for now.  Only callers that already have a
+        file-like object to write to (say, a PageFile) get streaming, and they
+        get it by calling write_html_for_comic() directly.
+        '''
+        out = StringIO.StringIO()
+        self.write_html_for_comic(comic_file, out)
+        return out.getvalue()
+
+    def write_html_for_comic(self, comic_file, outfile):
+        '''
+        Writes the HTML that should be output for a given comic file to the
+        given file-like object.  This is the same output get_html_for_comic()
+        gives you, except text files get copied over in COMIC_CHUNK_SIZE
+        chunks, so a gigantic text comic won't have to fit in memory all at
+        once.
         '''
 
         # First, the text files.
-        if comic_file.endswith('.html') or comic_file.endswith('.htm') or comic_file.endswith('.text') or comic_file.endswith('.txt'):
+        if _is_text_comic(comic_file):
+            path = Globals.get_directory_for("comicsdir") + comic_file
+
+            # If it's been prefetched, we've already got it.
+            if self._prefetcher is not None:
+                text = self._prefetcher.get(path)
+                if text is not None:
+                    outfile.write(text)
+                    outfile.write("\n")
+                    return
+
             # For this, we MUST be able to open the file.  If not, we have to
-            # return an error.
+            # write an error.
             try:
-                f = open(Globals.get_directory_for("comicsdir") + comic_file, 'r')
-                # We'll just dump the entire file for now.  I really really hope
-                # you don't have need for a file big enough to exhaust memory.
-                return f.read() + "\n"
+                f = open(path, 'r')
             except Exception as e:
                 print "ERROR: Couldn't open text file {} for output: {}".format(comic_file, e.strerror)
-                return "<p><b>ERROR:</b> Couldn't open text file {} for output!</p>\n".format(comic_file)
+                outfile.write("<p><b>ERROR:</b> Couldn't open text file {} for output!</p>\n".format(comic_file))
+                return
+
+            # Shovel it over a chunk at a time.  Once we've started writing,
+            # there's no taking it back, so don't try to replace it with an
+            # error message if something breaks partway through.
+            try:
+                shutil.copyfileobj(f, outfile, COMIC_CHUNK_SIZE)
+            finally:
+                f.close()
+            outfile.write("\n")
         else:
             # It's anything else, so it goes in an img.  Maybe at some point we
             # can do something for those poor souls still trying to dump out
             # swfs.  That point is not now.
             #
             # TODO: Work out a caption and/or title-text system!
-            return "<img src=\"{}\" class=\"comicimage\" />\n<br />\n".format(Globals.get_webpath_for('comicswebpath') + comic_file)
+            src = Globals.get_webpath_for('comicswebpath') + comic_file
+
+            # If we've got a hash for it, tack that on so caches know when the
+            # image changed.
+            if self._hash_index is not None:
+                filehash = self._hash_index.get_hash(comic_file)
+                if filehash is not None:
+                    src += "?v=" + filehash
+
+            outfile.write("<img src=\"{}\" class=\"comicimage\" />\n<br />\n".format(src))
 
     def get_html_for_tuple(self, comic_tuple):
         '''
         Gets the HTML that should be output for a given comic tuple, as
         retrieved from the get_first/last/next/prev family.  That is, this just
         calls get_html_for_comic() on each member of the comic file list and
-        concatenates all the output.
+        concatenates all the output.  Same caveat as get_html_for_comic(): this
+        buffers everything; use write_html_for_tuple() if you've got a writer.
         '''
-        toreturn = ""
+        out = StringIO.StringIO()
+        self.write_html_for_tuple(comic_tuple, out)
+        return out.getvalue()
 
+    def write_html_for_tuple(self, comic_tuple, outfile):
+        '''
+        Like get_html_for_tuple(), but writes everything to the given file-like
+        object as it goes instead of concatenating it all together.
+        '''
         for comic in comic_tuple[1]:
-            toreturn += self.get_html_for_comic(comic)
-
-        return toreturn
+            self.write_html_for_comic(comic, outfile)
 
@@ -59,7 +59,19 @@ CONFIG_DEFAULTS = {
             'rsstitle':'DEFAULT TITLE',
             'rsslink':'http://localhost',
             'rssdescription':'Edit this in the config file!',
-            'rsscopyright':'Something something copyright'
+            'rsscopyright':'Something something copyright',
+            'cachebustimages':'0',
+            'imagehashfile':'imagehashes.json',
+            'hashthreads':'4',
+            'gzippages':'0',
+            'gzipthreads':'2',
+            'manifestfile':'manifest.json',
+            'manifestdryrun':'0',
+            'sitemapfile':'sitemap.xml',
+            'latestfile':'latest.html',
+            'latestcount':'10',
+            'prefetchthreads':'8',
+            'prefetchcachesize':'8388608'
         }
 
 config = ConfigParser.RawConfigParser(defaults=CONFIG_DEFAULTS, allow_no_value=True)
@@ -146,6 +158,12 @@ def read_config(filename):
         config.getboolean('AutoNifty', checking)
         checking = 'rsslitegenerate'
         config.getboolean('AutoNifty', checking)
+        checking = 'cachebustimages'
+        config.getboolean('AutoNifty', checking)
+        checking = 'gzippages'
+        config.getboolean('AutoNifty', checking)
+        checking = 'manifestdryrun'
+        config.getboolean('AutoNifty', checking)
     except ValueError:
         raise ValueError("The {} config option MUST be something that resolves to True or False!".format(checking))
 
@@ -159,6 +177,39 @@ def read_config(filename):
     if timezone < -1200 or timezone > 1200 or abs(timezone) % 100 >= 60:
         raise ValueError("{} isn't a valid timezone offset!".format(timezone))
 
+    # We need at least one thread to hash images with, one to compress pages
+    # with, and one to prefetch files with.
+    for checking in ['hashthreads', 'gzipthreads', 'prefetchthreads']:
+        threads = 0
+        try:
+            threads = config.getint('AutoNifty', checking)
+        except ValueError:
+            raise ValueError("The {} config option MUST be something that resolves to an integer!".format(checking))
+
+        if threads < 1:
+            raise ValueError("{} isn't a valid number of threads for {}!".format(threads, checking))
+
+    # The prefetch cache can't be negative.  It can be zero, though, if you
+    # really want it to not cache anything.
+    cachesize = 0
+    try:
+        cachesize = config.getint('AutoNifty', 'prefetchcachesize')
+    except ValueError:
+        raise ValueError("The prefetchcachesize config option MUST be something that resolves to an integer!")
+
+    if cachesize < 0:
+        raise ValueError("{} isn't a valid prefetch cache size!".format(cachesize))
+
+    # The latest comics list has to have at least one comic in it.
+    latestcount = 0
+    try:
+        latestcount = config.getint('AutoNifty', 'latestcount')
+    except ValueError:
+        raise ValueError("The latestcount config option MUST be something that resolves to an integer!")
+
+    if latestcount < 1:
+        raise ValueError("{} isn't a valid number of latest comics!".format(latestcount))
+
     # The update time has to be, y'know, a time.  However, we allow the user to
     # specify this time with a space in it, so just in case...
     updatetime = "".join(config.get('AutoNifty', 'updatetime').split())
@@ -0,0 +1,161 @@
+import Globals
+import hashlib
+import json
+import os
+from multiprocessing.pool import ThreadPool
+
+# How much of an image gets read in at a time while hashing it.
+HASH_CHUNK_SIZE = 64 * 1024
+
+# How many hex digits of the hash actually make it into the URL.  Twelve is
+# plenty to tell one version of a comic from another.
+HASH_LENGTH = 12
+
+def _hash_file(path):
+    '''
+    Hashes a single file, returning the (shortened) hex digest.  This is what
+    the thread pool workers run, so it doesn't touch any shared state.  If the
+    file can't be read, we complain and return None; that file just won't get
+    a hash.
+    '''
+    hasher = hashlib.sha1()
+    try:
+        f = open(path, 'rb')
+        try:
+            while True:
+                chunk = f.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+        finally:
+            f.close()
+    except (IOError, OSError) as e:
+        print "ERROR: Couldn't hash image file {}: {}".format(path, e.strerror)
+        return None
+
+    return hasher.hexdigest()[:HASH_LENGTH]
+
+class HashIndex(object):
+    '''
+    The HashIndex keeps track of content hashes for the comic images, so we can
+    stick a fingerprint on the end of their URLs and let caches hang onto them
+    forever.  Hashing every image on every run would be silly, so the index is
+    saved in datadir and each entry remembers the size and mtime of the file
+    it came from.  Only files where either of those changed get hashed again.
+
+    The index is keyed by filename (relative to comicsdir, same as what
+    ComicBucket hands around), and each value is a list of [size, mtime, hash].
+    '''
+    def __init__(self):
+        self._filename = Globals.get_directory_for('datadir') + Globals.config.get('AutoNifty', 'imagehashfile')
+        self._entries = {}
+
+    def load(self):
+        '''
+        Reads the index in from datadir.  If it's not there (or it's garbage),
+        we just start with an empty index; everything'll get hashed again,
+        which is slow, but not wrong.
+        '''
+        self._entries = {}
+
+        try:
+            f = open(self._filename, 'r')
+        except IOError:
+            # No index yet.  That's fine, it's probably the first run.
+            return
+
+        try:
+            loaded = json.load(f)
+        except ValueError:
+            print "HashIndex: {} isn't a valid hash index, starting over...".format(self._filename)
+            return
+        finally:
+            f.close()
+
+        # JSON hands everything back as unicode, but ComicBucket's filenames
+        # are plain (UTF-8) strings, so turn them back into those.  Otherwise
+        # anything with a non-ASCII name would never match and get re-hashed
+        # every single time.
+        for fname, entry in loaded.items():
+            self._entries[fname.encode('utf-8')] = [entry[0], entry[1], entry[2].encode('utf-8')]
+
+    def save(self):
+        '''
+        Writes the index back out to datadir.  This goes to a temporary file
+        first so a crash halfway through won't leave a broken index behind.
+
+        Filenames that aren't valid UTF-8 can't go in a JSON file, so those get
+        left out (and will just be hashed again next time).
+        '''
+        tosave = {}
+        for fname, entry in self._entries.items():
+            try:
+                tosave[fname.decode('utf-8')] = entry
+            except UnicodeDecodeError:
+                print "HashIndex: {} isn't a UTF-8 filename, not saving its hash...".format(repr(fname))
+
+        tempname = self._filename + '.tmp'
+        f = open(tempname, 'w')
+        try:
+            json.dump(tosave, f)
+        finally:
+            f.close()
+        os.rename(tempname, self._filename)
+
+    def update(self, directory, filenames):
+        '''
+        Brings the index up to date for the given files in the given directory.
+        Anything new or changed (by size or mtime) gets hashed, in parallel,
+        using hashthreads workers.  Anything in the index that isn't in
+        filenames (or that couldn't be read) gets dropped.
+
+        Returns the number of files that had to be hashed.
+        '''
+        fresh = {}
+        stale = []
+
+        for fname in filenames:
+            try:
+                stat = os.stat(directory + fname)
+            except OSError:
+                # Vanished out from under us?  Then it doesn't get a hash.
+                continue
+
+            entry = self._entries.get(fname)
+            if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+                fresh[fname] = entry
+            else:
+                stale.append((fname, stat.st_size, stat.st_mtime))
+
+        if len(stale) > 0:
+            paths = [directory + s[0] for s in stale]
+            threads = Globals.config.getint('AutoNifty', 'hashthreads')
+
+            if len(stale) == 1 or threads <= 1:
+                hashes = map(_hash_file, paths)
+            else:
+                pool = ThreadPool(min(threads, len(stale)))
+                try:
+                    hashes = pool.map(_hash_file, paths)
+                finally:
+                    pool.close()
+                    pool.join()
+
+            for s, h in zip(stale, hashes):
+                # Anything we couldn't hash stays out of the index, so its URL
+                # goes out without a fingerprint.
+                if h is not None:
+                    fresh[s[0]] = [s[1], s[2], h]
+
+        self._entries = fresh
+        return len(stale)
+
+    def get_hash(self, filename):
+        '''
+        Gets the hash for a given file, or None if the index doesn't know about
+        it.
+        '''
+        entry = self._entries.get(filename)
+        if entry is None:
+            return None
+        return entry[2]
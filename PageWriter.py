@@ -0,0 +1,150 @@
+import Globals
+import filecmp
+import os
+import tempfile
+from Precompressor import Precompressor
+
+class PageFile(object):
+    '''
+    A PageFile is what you actually write a page into.  It acts like a
+    (write-only) file, but everything goes to a temporary file next to the real
+    one.  When it's closed, the PageWriter checks whether anything actually
+    changed and only then swaps it in.  That way, pages that come out the same
+    keep their old mtimes and don't get recompressed or reuploaded or whatever.
+
+    It also works in a with statement.  If something's raised in there, the
+    temporary file gets thrown out and the old page is left alone.
+    '''
+    def __init__(self, writer, filename, compress):
+        self._writer = writer
+        self._filename = filename
+        self._compress = compress
+
+        fd, self._tempname = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=os.path.dirname(filename) or '.')
+        self._file = os.fdopen(fd, 'w')
+
+    def write(self, data):
+        self._file.write(data)
+
+    def close(self):
+        '''
+        Finishes writing the page and hands it back to the PageWriter.
+        '''
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self._writer._commit(self._filename, self._tempname, self._compress)
+
+    def discard(self):
+        '''
+        Throws out whatever's been written so far without touching the real
+        page.
+        '''
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.remove(self._tempname)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+class PageWriter(object):
+    '''
+    The PageWriter is the output end of a build.  Every page and feed goes out
+    through open_page(), which gives you a PageFile to write into.  The
+    PageWriter keeps track of what got produced and what actually changed, and
+    if gzippages is on, kicks off a .gz sidecar for each changed page as soon
+    as it's written.
+
+    Call finish() once all the pages are out.
+    '''
+    def __init__(self):
+        self._produced = []
+        self._changed = []
+        self._precompressor = None
+
+        # The only way to find out the umask is to set it, so do that exactly
+        # once, here, before any Precompressor threads exist that could be
+        # creating files while it's briefly wrong.
+        self._umask = os.umask(0)
+        os.umask(self._umask)
+
+        if Globals.config.getboolean('AutoNifty', 'gzippages'):
+            self._precompressor = Precompressor(self._umask)
+
+    def open_page(self, filename, compress=True):
+        '''
+        Opens a page for writing.  filename should be the full path where the
+        page will wind up.  Set compress to False for things that don't need a
+        .gz sidecar even if gzippages is on (template fragments and such).
+        '''
+        return PageFile(self, filename, compress)
+
+    def _commit(self, filename, tempname, compress):
+        '''
+        Called by PageFile when it's closed.  If the new page is the same as
+        what's already there, the temporary file gets tossed.  Otherwise, it
+        replaces the old page.
+        '''
+        changed = True
+        if os.path.isfile(filename) and filecmp.cmp(tempname, filename, shallow=False):
+            changed = False
+
+        if changed:
+            # mkstemp is kind of stingy with permissions, so make the page
+            # readable like any other file would be.
+            os.chmod(tempname, 0666 & ~self._umask)
+            os.rename(tempname, filename)
+            self._changed.append(filename)
+
+            # Whatever sidecar was there is for the old page now.  Get rid of
+            # it before anything else, so if the new one doesn't get written
+            # (compression fails, or gzippages is off), the web server falls
+            # back to the fresh page instead of serving stale content.
+            try:
+                os.remove(filename + '.gz')
+            except OSError:
+                pass
+        else:
+            os.remove(tempname)
+
+        self._produced.append(filename)
+
+        if compress and self._precompressor is not None:
+            # An unchanged page still needs a sidecar if it doesn't have one
+            # yet (say, gzippages was only just turned on).
+            if changed or not os.path.isfile(filename + '.gz'):
+                self._precompressor.submit(filename)
+            else:
+                self._produced.append(filename + '.gz')
+
+    def finish(self):
+        '''
+        Waits for any outstanding compression to finish.  Do this before
+        calling it a build.
+        '''
+        if self._precompressor is not None:
+            self._produced.extend(self._precompressor.finish())
+            self._precompressor = None
+
+    def get_produced(self):
+        '''
+        Gets the list of every file this build produced, changed or not
+        (including sidecars, once finish() has been called).
+        '''
+        return self._produced
+
+    def get_changed(self):
+        '''
+        Gets the list of pages whose content actually changed this build.
+        '''
+        return self._changed
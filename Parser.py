@@ -1,4 +1,5 @@
 import re
+import StringIO
 from tag.TagFactory import TagFactory
 import Globals
 
@@ -6,6 +7,30 @@ import Globals
 # amount of params it might have (can be None).
 TAG_RE = re.compile("\*\*\*\s*(\S+?)(?:\s+(.+?))?\s*\*\*\*")
 
+def resolve_include(name):
+    '''
+    Turns the parameter of an ***include*** tag into the path of the file it
+    means.  Relative names are relative to parsedir; absolute ones are left
+    alone.  Anything that opens or looks up an included file (the Prefetcher,
+    Parser.parse_include()) has to go through this, so they all agree on what
+    the file is called.
+
+    TODO: This doesn't do the normalizing or root-checking that
+    parse_file_by_name() wants yet.  When that happens, it happens here.
+    '''
+    if name[0] == '/':
+        return name
+    return Globals.get_directory_for('parsedir') + name
+
+def find_includes(text):
+    '''
+    Finds all the files a chunk of text includes with an ***include*** tag,
+    without actually parsing anything, resolved with resolve_include().  This
+    is what the Prefetcher uses to figure out what a page is going to need
+    before it gets rendered.
+    '''
+    return [resolve_include(match.group(2)) for match in TAG_RE.finditer(text) if match.group(1).lower() == 'include' and match.group(2)]
+
 class Parser(object):
     '''
     The Parser is what gets looped through to parse files.  Ultimately, this is
@@ -15,9 +40,10 @@ class Parser(object):
     This also stores a bunch of state data about the current parse operation.
     This can be useful for some tags.
     '''
-    def __init__(self):
+    def __init__(self, prefetcher=None):
         # TODO: Needs some way to get global data!  Comic lists, the storyline,
         # etc, etc...
+        self._prefetcher = prefetcher
         self._seen_files = {}
         self._tag_factory = TagFactory(self)
         self._today = Globals.get_today()
@@ -27,7 +53,9 @@ class Parser(object):
         '''
         Parses a file, given its name.  It'll open up the file or bail out if it
         can't read it (it WILL return text in that case!).  Then it shoves the
-        whole thing line-by-line to _parse_line and returns the result.
+        whole thing line-by-line to _parse_line and returns the result.  If this
+        Parser has a Prefetcher and it's already got the file, that gets used
+        instead of opening it again.
 
         This returns False if the file's already been seen in this include
         chain, though.  Check for that.
@@ -46,9 +74,20 @@ class Parser(object):
         if(self._mark_file_seen(filename) == False):
             return "ERROR: This is an include loop!  You already included {}!".to_parse
 
-        # Open 'er up and read it in!
+        # Open 'er up and read it in!  Or, if it's been prefetched, just use
+        # that.
         try:
-            fileobj = open(filename)
+            fileobj = None
+            if self._prefetcher is not None:
+                text = self._prefetcher.get(filename)
+                if text is not None:
+                    # StringIO splits lines exactly like a real file would
+                    # (splitlines() would also break on a bare \r), so tags
+                    # match the same way whether or not the file was cached.
+                    fileobj = StringIO.StringIO(text)
+
+            if fileobj is None:
+                fileobj = open(filename)
 
             toreturn = ""
 
@@ -62,6 +101,14 @@ class Parser(object):
         except IOError as ioe:
             return "ERROR: Something went wrong reading file {}!".format(filename)
 
+    def parse_include(self, name):
+        '''
+        Parses a file named by an ***include*** tag.  This is just
+        parse_file_by_name() on whatever resolve_include() says the file is,
+        which is also what the Prefetcher will have fetched it as.
+        '''
+        return self.parse_file_by_name(resolve_include(name))
+
     def parse_text(self, to_parse):
         '''
         Parses a big ol' chunk of text.  It'll do this line-by-line.  All
@@ -0,0 +1,90 @@
+import Globals
+import gzip
+import os
+import shutil
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+# How much of a page gets read in at a time while compressing it.
+GZIP_CHUNK_SIZE = 64 * 1024
+
+def _compress_file(filename, mode):
+    '''
+    Writes filename.gz next to filename, with the given permissions.  This
+    uses max compression and a zero mtime in the header (and no filename in
+    there, either), so the same page always compresses to the same bytes.
+    This is what the pool workers run.
+
+    It all goes to a uniquely-named temporary file first, which gets cleaned
+    up if anything goes wrong, so a failure (disk full, say) never leaves junk
+    lying around in sitedir.
+    '''
+    gzname = filename + '.gz'
+
+    infile = open(filename, 'rb')
+    try:
+        fd, tempname = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=os.path.dirname(filename) or '.')
+        try:
+            outfile = os.fdopen(fd, 'wb')
+            try:
+                gz = gzip.GzipFile(filename='', mode='wb', compresslevel=9, fileobj=outfile, mtime=0)
+                try:
+                    shutil.copyfileobj(infile, gz, GZIP_CHUNK_SIZE)
+                finally:
+                    gz.close()
+            finally:
+                outfile.close()
+
+            os.chmod(tempname, mode)
+            os.rename(tempname, gzname)
+        except:
+            try:
+                os.remove(tempname)
+            except OSError:
+                pass
+            raise
+    finally:
+        infile.close()
+
+    return gzname
+
+class Precompressor(object):
+    '''
+    The Precompressor writes .gz sidecars for generated pages so the web server
+    can just hand those out instead of compressing everything on the fly.
+    Pages get submitted as they're finished and compressed in the background
+    by a pool of gzipthreads workers, so the rest of the build can carry on in
+    the meantime.  Call finish() once everything's been submitted.
+
+    The umask is passed in rather than looked up, since looking it up means
+    changing it, and that's not safe with the workers creating files.
+    '''
+    def __init__(self, umask):
+        self._mode = 0666 & ~umask
+        self._pool = ThreadPool(Globals.config.getint('AutoNifty', 'gzipthreads'))
+        self._pending = []
+
+    def submit(self, filename):
+        '''
+        Queues up a page to be compressed.
+        '''
+        self._pending.append((filename, self._pool.apply_async(_compress_file, (filename, self._mode))))
+
+    def finish(self):
+        '''
+        Waits for everything submitted to finish compressing and shuts the pool
+        down.  Returns the list of sidecar files written.  If any of them
+        failed, we complain about it, but carry on with the rest.
+        '''
+        self._pool.close()
+        self._pool.join()
+
+        written = []
+        for filename, result in self._pending:
+            try:
+                written.append(result.get())
+            except (IOError, OSError) as e:
+                print "ERROR: Couldn't write gzip sidecar for {}: {}".format(filename, e.strerror)
+
+        self._pending = []
+        return written
@@ -0,0 +1,141 @@
+import Globals
+import collections
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+from Parser import find_includes
+
+def _read_file(filename, limit):
+    '''
+    Reads a whole file in, unless it's bigger than limit, in which case it
+    isn't worth caching and we return None.  Same if we can't read it; whoever
+    asks for it later can open it themselves and report the error properly.
+    This is what the pool workers run.
+    '''
+    try:
+        if os.path.getsize(filename) > limit:
+            return None
+
+        f = open(filename, 'r')
+        try:
+            return f.read()
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return None
+
+class Prefetcher(object):
+    '''
+    The Prefetcher reads the files a page is going to need (templates, their
+    includes, text comics) ahead of time, in parallel, using a pool of
+    prefetchthreads workers.  Everything it reads goes in a cache capped at
+    prefetchcachesize bytes, oldest-used out first.  Parser and ComicBucket
+    ask it for files before opening them themselves, so if it's done its job,
+    rendering a page never has to sit around waiting on a slow disk.
+
+    Any single file over a quarter of the cache size doesn't get cached at
+    all, so one huge file can't push everything else out.  Those just get
+    read (or streamed) the normal way.
+
+    Call finish() when you're done with it to shut the pool down.
+    '''
+    def __init__(self):
+        self._pool = ThreadPool(Globals.config.getint('AutoNifty', 'prefetchthreads'))
+        self._max_bytes = Globals.config.getint('AutoNifty', 'prefetchcachesize')
+        self._file_limit = self._max_bytes // 4
+
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()
+        self._cache_bytes = 0
+        self._pending = {}
+
+    def prefetch(self, filenames):
+        '''
+        Starts reading in the given files in the background.  Anything already
+        cached or on its way doesn't get read again.
+        '''
+        with self._lock:
+            for filename in filenames:
+                if filename in self._cache or filename in self._pending:
+                    continue
+
+                callback = lambda data, filename=filename: self._store(filename, data)
+                self._pending[filename] = self._pool.apply_async(_read_file, (filename, self._file_limit), callback=callback)
+
+    def prefetch_page(self, template, comic_files=()):
+        '''
+        Prefetches everything a page needs: the template, everything it
+        includes (and everything THOSE include, and so on), and the given comic
+        files (say, from ComicBucket.get_text_files_for()).  The comics get
+        started right away; the includes have to wait until whatever includes
+        them has been read, so we go down the include chain one level at a
+        time.
+        '''
+        self.prefetch([template] + list(comic_files))
+
+        seen = set([template])
+        level = [template]
+        while len(level) > 0:
+            nextlevel = []
+            for filename in level:
+                text = self.get(filename)
+                if text is None:
+                    continue
+
+                for include in find_includes(text):
+                    if include not in seen:
+                        seen.add(include)
+                        nextlevel.append(include)
+
+            self.prefetch(nextlevel)
+            level = nextlevel
+
+    def get(self, filename):
+        '''
+        Gets the contents of a file if we've got it (waiting for it if it's
+        still being read), or None if we don't.  If you get None, go open the
+        file yourself.
+        '''
+        with self._lock:
+            if filename in self._cache:
+                data = self._cache.pop(filename)
+                self._cache[filename] = data
+                return data
+
+            result = self._pending.get(filename)
+
+        if result is None:
+            return None
+
+        return result.get()
+
+    def _store(self, filename, data):
+        '''
+        Called from the pool when a file's been read.  Puts it in the cache and
+        throws out the least recently used stuff until we're under the limit
+        again.
+        '''
+        with self._lock:
+            self._pending.pop(filename, None)
+
+            if data is None:
+                return
+
+            self._cache[filename] = data
+            self._cache_bytes += len(data)
+
+            while self._cache_bytes > self._max_bytes:
+                oldname, olddata = self._cache.popitem(last=False)
+                self._cache_bytes -= len(olddata)
+
+    def finish(self):
+        '''
+        Shuts down the pool and empties out the cache.
+        '''
+        self._pool.close()
+        self._pool.join()
+
+        with self._lock:
+            self._cache.clear()
+            self._cache_bytes = 0
+            self._pending = {}
@@ -0,0 +1,138 @@
+import Globals
+import collections
+import datetime
+import os
+from xml.sax.saxutils import escape
+
+# The sitemap protocol says no more than this many URLs per file.
+SITEMAP_URL_LIMIT = 50000
+
+SITEMAP_NS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+
+class Sitemap(object):
+    '''
+    The Sitemap writes out sitemap.xml (or sitemapfile, anyway) for all the
+    archive pages, along with a "latest comics" HTML fragment listing the
+    newest latestcount dates, suitable for including in a template.  Both come
+    out of one pass over the ComicBucket and get written as they go through a
+    PageWriter, so nothing ever has to be built up as one big string.
+
+    If there are more archive pages than one sitemap is allowed to hold, they
+    get split into numbered sitemaps (sitemap-1.xml, sitemap-2.xml, etc) and
+    sitemapfile becomes a sitemap index pointing at them.
+
+    The lastmod dates come from the archive pages themselves, so write this
+    AFTER the archive pages have gone out.
+    '''
+    def __init__(self, bucket, writer):
+        self._bucket = bucket
+        self._writer = writer
+
+    def write(self):
+        '''
+        Writes everything out.  Returns the number of archive pages listed.
+        '''
+        sitedir = Globals.get_directory_for('sitedir')
+        sitemapfile = Globals.config.get('AutoNifty', 'sitemapfile')
+        archivewebpath = Globals.get_webpath_for('archivewebpath')
+        dailyext = Globals.config.get('AutoNifty', 'dailyext')
+
+        # We know how many dates there are up front, so we know right away if
+        # this needs splitting.
+        total = len(self._bucket)
+        split = total > SITEMAP_URL_LIMIT
+        parts = []
+
+        latest = collections.deque(maxlen=Globals.config.getint('AutoNifty', 'latestcount'))
+
+        page = None
+        count = 0
+        for datestamp in self._bucket.keys():
+            if page is None:
+                if split:
+                    filename = self._get_part_name(sitemapfile, len(parts) + 1)
+                else:
+                    filename = sitemapfile
+                parts.append(filename)
+                page = self._writer.open_page(sitedir + filename)
+                page.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+                page.write('<urlset xmlns="{}">\n'.format(SITEMAP_NS))
+
+            url = archivewebpath + datestamp + dailyext
+            page.write('<url><loc>{}</loc><lastmod>{}</lastmod></url>\n'.format(escape(url), self._get_lastmod(datestamp, dailyext)))
+            latest.append((datestamp, url))
+
+            count += 1
+            if count % SITEMAP_URL_LIMIT == 0:
+                page.write('</urlset>\n')
+                page.close()
+                page = None
+
+        # No comics at all?  Still write an (empty) sitemap, or the old one
+        # gets cleaned up as an orphan and crawlers get a 404.
+        if count == 0:
+            parts.append(sitemapfile)
+            page = self._writer.open_page(sitedir + sitemapfile)
+            page.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            page.write('<urlset xmlns="{}">\n'.format(SITEMAP_NS))
+
+        if page is not None:
+            page.write('</urlset>\n')
+            page.close()
+
+        if split:
+            self._write_index(sitedir + sitemapfile, parts)
+
+        self._write_latest(latest)
+
+        return count
+
+    def _get_part_name(self, sitemapfile, number):
+        '''
+        Turns sitemap.xml into sitemap-1.xml and so forth.
+        '''
+        base, ext = os.path.splitext(sitemapfile)
+        return "{}-{}{}".format(base, number, ext)
+
+    def _get_lastmod(self, datestamp, dailyext):
+        '''
+        Figures out the lastmod for a date's archive page, as a W3C date.
+        That's the mtime of the generated page itself; PageWriter leaves
+        unchanged pages alone, so that only moves when the page really changed
+        (new comic, new neighbours in the nav links, template changes, etc).
+        '''
+        try:
+            mtime = os.stat(Globals.get_directory_for('archivedir') + datestamp + dailyext).st_mtime
+        except OSError:
+            # No page yet?  Well, it can't be older than the date it went up,
+            # at least.
+            return "{}-{}-{}".format(datestamp[0:4], datestamp[4:6], datestamp[6:8])
+
+        return datetime.datetime.utcfromtimestamp(mtime).strftime("%Y-%m-%d")
+
+    def _write_index(self, filename, parts):
+        '''
+        Writes out the sitemap index pointing at all the numbered sitemaps.
+        '''
+        url = Globals.config.get('AutoNifty', 'url')
+
+        page = self._writer.open_page(filename)
+        page.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        page.write('<sitemapindex xmlns="{}">\n'.format(SITEMAP_NS))
+        for part in parts:
+            page.write('<sitemap><loc>{}</loc></sitemap>\n'.format(escape(url + part)))
+        page.write('</sitemapindex>\n')
+        page.close()
+
+    def _write_latest(self, latest):
+        '''
+        Writes out the latest comics fragment into datadir, newest first.
+        '''
+        filename = Globals.get_directory_for('datadir') + Globals.config.get('AutoNifty', 'latestfile')
+
+        page = self._writer.open_page(filename, compress=False)
+        page.write('<ul class="latestcomics">\n')
+        for datestamp, url in reversed(latest):
+            page.write('<li><a href="{}">{}-{}-{}</a></li>\n'.format(escape(url, {'"': '&quot;'}), datestamp[0:4], datestamp[4:6], datestamp[6:8]))
+        page.write('</ul>\n')
+        page.close()